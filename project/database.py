@@ -1,12 +1,74 @@
-from sqlalchemy import create_engine, Column, Integer, String
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event, inspect, select, Column, ForeignKey, Integer, String
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, selectinload
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger("uvicorn.error")
 
 # SQLite database file will be created in your project folder
-DATABASE_URL = "sqlite:///./arogyapath.db"
+# (override with e.g. DATABASE_URL=sqlite:///:memory: for throwaway runs)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./arogyapath.db")
+
+engine_options = {"connect_args": {"check_same_thread": False}}
+if ":memory:" in DATABASE_URL:
+    # Every connection to :memory: is a fresh empty database, so share a single one
+    engine_options["poolclass"] = StaticPool
+elif os.getenv("DEPLOY_TARGET") == "serverless":
+    # Short-lived instances: open and close a connection per request, nothing left checked out
+    engine_options["poolclass"] = NullPool
+else:
+    engine_options.update(
+        poolclass=QueuePool,
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+    )
+
+engine = create_engine(DATABASE_URL, **engine_options)
+
+
+# WAL lets readers keep going while a signup is writing; the rest trades
+# a little durability on power loss for fewer fsyncs and a bigger page cache
+def _set_sqlite_pragmas(dbapi_conn, _):
+    cursor = dbapi_conn.cursor()
+    # WAL is stored in the file, so this only has to succeed once. The switch needs an
+    # exclusive lock and fails straight away (no busy wait) while another worker that is
+    # starting up holds one; it is then retried by the next connection
+    if cursor.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError:
+            pass
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-20000")  # 20 MB
+    cursor.close()
+
+
+event.listen(engine, "connect", _set_sqlite_pragmas)
+
+
+# ─── SLOW QUERY LOG ───────────────────────────────────────────────
+SLOW_QUERY_SECONDS = 0.1
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    if elapsed > SLOW_QUERY_SECONDS:
+        logger.warning("Slow query (%.0f ms): %s", elapsed * 1000, statement)
+
+
+event.listen(engine, "before_cursor_execute", _start_query_timer)
+event.listen(engine, "after_cursor_execute", _log_slow_query)
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
@@ -20,7 +82,7 @@ class User(Base):
     name               = Column(String, nullable=False)
     age                = Column(Integer, nullable=False)
     gender             = Column(String, nullable=False)
-    mobile             = Column(String, unique=True, nullable=False)
+    mobile             = Column(String, unique=True, index=True, nullable=False)
     password           = Column(String, nullable=False)        # hashed
 
     # Category: "disabled" or "senior"
@@ -29,17 +91,65 @@ class User(Base):
     # Disabled sub-type: "wheelchair" or "blind"
     disability_type    = Column(String, nullable=True)
 
-    # Emergency contacts (stored as "Name:Number,Name:Number")
+    # Emergency contacts as submitted on signup ("Name:Number,Name:Number");
+    # read them through emergency_contacts_rel instead of parsing this
     emergency_contacts = Column(String, nullable=True)
 
+    # Lazy by default; pages that show contacts ask for them with selectinload
+    emergency_contacts_rel = relationship("EmergencyContact", cascade="all, delete-orphan")
+
+
+# ─── EMERGENCY CONTACT TABLE ──────────────────────────────────────
+class EmergencyContact(Base):
+    __tablename__ = "emergency_contacts"
+
+    id      = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    name    = Column(String, nullable=False)
+    number  = Column(String, nullable=False)
+
 
 # ─── CREATE TABLES ────────────────────────────────────────────────
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # One table listing instead of create_all's per-table probes; nothing to do
+    # on a normal restart once every table exists
+    if not set(Base.metadata.tables) - set(inspect(engine).get_table_names()):
+        return
+
+    # Several workers can start at once on a fresh or upgraded database.
+    # BEGIN IMMEDIATE takes SQLite's write lock up front, so they run this block
+    # one after another and each re-checks what the previous one already created
+    with engine.begin() as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        missing = set(Base.metadata.tables) - set(inspect(conn).get_table_names())
+        Base.metadata.create_all(bind=conn)
+
+        # Contacts used to live only in users.emergency_contacts; copy them over
+        # the first time the emergency_contacts table gets created
+        if "emergency_contacts" in missing:
+            migrate_emergency_contacts(conn)
+
+
+def migrate_emergency_contacts(conn):
+    # Only users without any contact rows yet, so running this twice inserts nothing
+    has_contacts = select(EmergencyContact.id).where(EmergencyContact.user_id == User.id).exists()
+    users = conn.execute(
+        select(User.id, User.emergency_contacts)
+        .where(User.emergency_contacts.isnot(None), ~has_contacts)
+    ).all()
+    rows = [
+        {"user_id": user_id, "name": name, "number": number}
+        for user_id, raw in users
+        for name, number in parse_emergency_contacts(raw)
+    ]
+    if rows:
+        conn.execute(EmergencyContact.__table__.insert(), rows)
 
 
 # ─── DB SESSION DEPENDENCY ────────────────────────────────────────
 def get_db():
+    # A Session only checks out a pool connection on its first statement, and
+    # closing one that never ran anything is free — no need to open it lazily
     db = SessionLocal()
     try:
         yield db
@@ -48,12 +158,25 @@ def get_db():
 
 
 # ─── HELPER FUNCTIONS ─────────────────────────────────────────────
+def parse_emergency_contacts(raw):
+    # "Name:Number,Name:Number" -> [(name, number), ...], skipping malformed entries
+    contacts = []
+    if raw:
+        for contact in raw.split(","):
+            parts = contact.split(":")
+            if len(parts) == 2:
+                contacts.append((parts[0], parts[1]))
+    return contacts
+
+
 def get_user_by_mobile(db, mobile: str):
     return db.query(User).filter(User.mobile == mobile).first()
 
 
-def get_user_by_id(db, user_id: int):
-    return db.query(User).filter(User.id == user_id).first()
+def get_user_by_id(db, user_id: int, with_contacts: bool = False):
+    # Session.get checks the identity map first and only hits SQLite on a miss
+    options = [selectinload(User.emergency_contacts_rel)] if with_contacts else []
+    return db.get(User, user_id, options=options)
 
 
 def create_user(db, name, age, gender, mobile, hashed_password,
@@ -67,8 +190,17 @@ def create_user(db, name, age, gender, mobile, hashed_password,
         category=category,
         disability_type=disability_type,
         emergency_contacts=emergency_contacts,
+        emergency_contacts_rel=[
+            EmergencyContact(name=name, number=number)
+            for name, number in parse_emergency_contacts(emergency_contacts)
+        ],
     )
     db.add(user)
     db.commit()
     db.refresh(user)
-    return user
\ No newline at end of file
+    return user
+
+
+def update_user_password(db, user, hashed_password):
+    user.password = hashed_password
+    db.commit()
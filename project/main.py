@@ -1,40 +1,153 @@
 from fastapi import FastAPI, Request, Form, Depends, HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse
 from sqlalchemy.orm import Session
+from cachetools import TTLCache
+from jinja2 import FileSystemBytecodeCache
+from operator import itemgetter
+import anyio.to_thread
+import asyncio
 import bcrypt
+import heapq
+import httpx
+import logging
+import math
+import numpy as np
+import orjson
+import os
+import time
+
+from database import (
+    init_db, get_db, get_user_by_mobile, create_user, get_user_by_id, update_user_password
+)
+
+app = FastAPI(default_response_class=ORJSONResponse)
+logger = logging.getLogger("uvicorn.error")
+
+# bcrypt cost factor — 10 keeps signup/login around ~100ms instead of ~250ms at the default 12
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+
+# Set BCRYPT_BENCHMARK=1 to log hash timings per cost factor once at startup,
+# handy for picking BCRYPT_ROUNDS on a new deployment host
+if os.getenv("BCRYPT_BENCHMARK"):
+    for cost in range(10, 14):
+        start = time.perf_counter()
+        bcrypt.hashpw(b"benchmark", bcrypt.gensalt(rounds=cost))
+        logger.info("bcrypt cost %d: %.0f ms", cost, (time.perf_counter() - start) * 1000)
+
+# Checked against when the mobile number is unknown, so both login failures cost one
+# bcrypt check. It uses BCRYPT_ROUNDS, which every account converges to once login
+# re-hashes its older cost-12 hash
+_DUMMY_HASH = bcrypt.hashpw(b"x", bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
 
-from database import init_db, get_db, get_user_by_mobile, create_user, get_user_by_id
-
-app = FastAPI()
 
 templates = Jinja2Templates(directory="templates")
+# Skip the per-render mtime check (set TEMPLATE_AUTO_RELOAD=1 while editing templates)
+# and keep compiled templates on disk so restarts don't re-parse them. With no
+# directory given, Jinja uses a private per-user temp dir (mode 0700, owner checked)
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD") == "1"
+templates.env.auto_reload = TEMPLATE_AUTO_RELOAD
+templates.env.bytecode_cache = FileSystemBytecodeCache()
+
+TEMPLATE_NAMES = (
+    "home.html", "emergency.html", "signup.html", "login.html",
+    "dashboard.html", "disabled.html", "senior.html",
+)
+
+# Pages that render the same for every visitor — served from memory, cacheable by browsers/CDNs
+STATIC_PAGES = ("home.html", "emergency.html", "signup.html", "login.html")
+_RENDERED = {}
+
+
+def static_page(name):
+    # With TEMPLATE_AUTO_RELOAD on, render live so template edits show without a restart
+    if TEMPLATE_AUTO_RELOAD:
+        return HTMLResponse(templates.env.get_template(name).render())
+    return HTMLResponse(_RENDERED[name], headers={"Cache-Control": "public, max-age=300"})
+
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Creates database tables on startup
 init_db()
 
 
+# One pooled Overpass client for the whole app — keeps TLS connections alive between /api/nearby calls
+@app.on_event("startup")
+def open_overpass_client():
+    app.state.overpass = httpx.AsyncClient(
+        base_url="https://overpass-api.de",
+        timeout=20,
+        limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+    )
+
+
+@app.on_event("startup")
+def warm_template_cache():
+    # Compile every page up front so the first visitor doesn't pay for it
+    for name in TEMPLATE_NAMES:
+        templates.env.get_template(name)
+    if not TEMPLATE_AUTO_RELOAD:
+        for name in STATIC_PAGES:
+            _RENDERED[name] = templates.env.get_template(name).render()
+
+
+@app.on_event("shutdown")
+async def close_overpass_client():
+    await app.state.overpass.aclose()
+
+
+# Overpass elements keyed by (lat, lng rounded to ~100m, filter), kept for 5 minutes
+_OVERPASS_CACHE = TTLCache(maxsize=4096, ttl=300)
+
+
+async def fetch_overpass_elements(cache_key, queries):
+    elements = _OVERPASS_CACHE.get(cache_key)
+    if elements is None:
+        # Sub-queries run concurrently so one slow part doesn't hold up the rest.
+        # return_exceptions lets every sub-query finish before the first error is
+        # raised, so a failing half never leaves the other running unobserved
+        responses = await asyncio.gather(*(
+            app.state.overpass.post("/api/interpreter", data={"data": query})
+            for query in queries
+        ), return_exceptions=True)
+        for resp in responses:
+            if isinstance(resp, BaseException):
+                raise resp
+        # Failed lookups raise before anything is stored, so errors are never cached.
+        # Overpass reports timeouts and out-of-memory as HTTP 200 with a "remark" and
+        # an empty or partial element list, so those count as failures too
+        elements = []
+        for resp in responses:
+            resp.raise_for_status()
+            payload = orjson.loads(resp.content)
+            if "remark" in payload:
+                raise RuntimeError(f"Overpass: {payload['remark']}")
+            elements.extend(payload.get("elements", []))
+        _OVERPASS_CACHE[cache_key] = elements
+    return elements
+
+
 # ─── HOME PAGE ────────────────────────────────────────────────────
 @app.get("/")
-def home(request: Request):
-    return templates.TemplateResponse("home.html", {"request": request})
+def home():
+    return static_page("home.html")
 
 
 # ─── EMERGENCY PAGE (no login required) ───────────────────────────
 @app.get("/emergency")
-def emergency(request: Request):
-    return templates.TemplateResponse("emergency.html", {"request": request})
+def emergency():
+    return static_page("emergency.html")
 
 
 # ─── SIGNUP ───────────────────────────────────────────────────────
 @app.get("/signup")
-def signup_page(request: Request):
-    return templates.TemplateResponse("signup.html", {"request": request})
+def signup_page():
+    return static_page("signup.html")
 
 @app.post("/signup")
-def signup(
+async def signup(
     request: Request,
     name: str = Form(...),
     age: int = Form(...),
@@ -61,8 +174,12 @@ def signup(
             "error": "Mobile number already registered. Please login."
         })
 
-    # Hash the password
-    hashed_pw = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    # Hash the password — bcrypt is CPU-bound, so keep it off the event loop
+    pw_bytes = password.encode("utf-8")
+    hashed_pw = await anyio.to_thread.run_sync(
+        bcrypt.hashpw, pw_bytes, bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    )
+    hashed_pw = hashed_pw.decode("utf-8")
 
     # Create user
     user = create_user(
@@ -86,11 +203,11 @@ def signup(
 
 # ─── LOGIN ────────────────────────────────────────────────────────
 @app.get("/login")
-def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+def login_page():
+    return static_page("login.html")
 
 @app.post("/login")
-def login(
+async def login(
     request: Request,
     mobile: str = Form(...),
     password: str = Form(...),
@@ -98,19 +215,34 @@ def login(
 ):
     # Find user
     user = get_user_by_mobile(db, mobile)
+
+    # Check password — always run bcrypt (against a dummy hash for unknown numbers)
+    # so response time doesn't reveal which mobile numbers are registered.
+    # bcrypt is CPU-bound, so keep it off the event loop
+    pw_bytes = password.encode("utf-8")
+    stored_hash = user.password.encode("utf-8") if user else _DUMMY_HASH
+    password_ok = await anyio.to_thread.run_sync(bcrypt.checkpw, pw_bytes, stored_hash)
+
     if not user:
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Mobile number not found. Please sign up."
         })
 
-    # Check password
-    if not bcrypt.checkpw(password.encode("utf-8"), user.password.encode("utf-8")):
+    if not password_ok:
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Incorrect password. Please try again."
         })
 
+    # Hashes made before BCRYPT_ROUNDS existed use cost 12 — bring them down to the
+    # current cost now that we have the plaintext, so later logins get the faster check
+    if int(user.password.split("$")[2]) != BCRYPT_ROUNDS:
+        new_hash = await anyio.to_thread.run_sync(
+            bcrypt.hashpw, pw_bytes, bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+        )
+        update_user_password(db, user, new_hash.decode("utf-8"))
+
     # Redirect directly to their category page — no generic dashboard
     if user.category in ("disabled", "differently_abled"):
         return RedirectResponse(url=f"/disabled/{user.id}", status_code=302)
@@ -124,146 +256,179 @@ def logout():
     return RedirectResponse(url="/", status_code=302)
 
 
-# ─── DASHBOARD ────────────────────────────────────────────────────
-@app.get("/dashboard/{user_id}")
-def dashboard(request: Request, user_id: int, db: Session = Depends(get_db)):
-    user = get_user_by_id(db, user_id)
+# Shared by every per-user page; repeat loads in one session come from the identity map
+def _load_user(db, user_id: int, with_contacts: bool = False):
+    user = get_user_by_id(db, user_id, with_contacts=with_contacts)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    return user
 
-    # Parse emergency contacts
-    emergency_contacts = []
-    if user.emergency_contacts:
-        for contact in user.emergency_contacts.split(","):
-            parts = contact.split(":")
-            if len(parts) == 2:
-                emergency_contacts.append({"name": parts[0], "number": parts[1]})
 
+# ─── DASHBOARD ────────────────────────────────────────────────────
+@app.get("/dashboard/{user_id}")
+def dashboard(request: Request, user_id: int, db: Session = Depends(get_db)):
+    user = _load_user(db, user_id, with_contacts=True)
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
         "user": user,
-        "emergency_contacts": emergency_contacts
+        "emergency_contacts": user.emergency_contacts_rel
     })
 
 
 # ─── CATEGORY PAGES ───────────────────────────────────────────────
 @app.get("/disabled/{user_id}")
 def disabled(request: Request, user_id: int, db: Session = Depends(get_db)):
-    user = get_user_by_id(db, user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    user = _load_user(db, user_id)
     return templates.TemplateResponse("disabled.html", {
         "request": request,
         "user": user,
         "disability_type": user.disability_type
     })
 
-@app.get("/api/nearby")
-def nearby(lat: float, lng: float, filter: str = "all"):
-    import httpx
-    import math
+@app.get("/senior/{user_id}")
+def senior(request: Request, user_id: int, db: Session = Depends(get_db)):
+    user = _load_user(db, user_id)
+    return templates.TemplateResponse("senior.html", {
+        "request": request,
+        "user": user
+    })
 
-    r = 2000  # 2km radius
 
-    # Build queries directly with f-strings — no .format() risk
-    queries_map = {
-        "elevator": f"""
-            node["highway"="elevator"](around:{r},{lat},{lng});
-            node["amenity"="elevator"](around:{r},{lat},{lng});
-            node["building"="elevator"](around:{r},{lat},{lng});
-            node["amenity"="hospital"](around:{r},{lat},{lng});
-            way["amenity"="hospital"](around:{r},{lat},{lng});
-            node["amenity"="clinic"](around:{r},{lat},{lng});
-            node["amenity"="mall"](around:{r},{lat},{lng});
-            way["shop"="mall"](around:{r},{lat},{lng});
-        """,
-        "rest": f"""
-            node["amenity"="bench"](around:{r},{lat},{lng});
-            node["leisure"="park"](around:{r},{lat},{lng});
-            way["leisure"="park"](around:{r},{lat},{lng});
-            node["amenity"="shelter"](around:{r},{lat},{lng});
-            node["tourism"="picnic_site"](around:{r},{lat},{lng});
-            node["amenity"="cafe"](around:{r},{lat},{lng});
-            node["amenity"="restaurant"](around:{r},{lat},{lng});
-        """,
-        "washroom": f"""
-            node["amenity"="toilets"](around:{r},{lat},{lng});
-            way["amenity"="toilets"](around:{r},{lat},{lng});
-            node["amenity"="hospital"](around:{r},{lat},{lng});
-            way["amenity"="hospital"](around:{r},{lat},{lng});
-            node["amenity"="clinic"](around:{r},{lat},{lng});
-            node["amenity"="pharmacy"](around:{r},{lat},{lng});
-            node["shop"="mall"](around:{r},{lat},{lng});
-            way["shop"="mall"](around:{r},{lat},{lng});
-            node["amenity"="cafe"](around:{r},{lat},{lng});
-            node["amenity"="restaurant"](around:{r},{lat},{lng});
-        """,
-        "hospital": f"""
-            node["amenity"="hospital"](around:{r},{lat},{lng});
-            way["amenity"="hospital"](around:{r},{lat},{lng});
-            node["amenity"="clinic"](around:{r},{lat},{lng});
-            node["amenity"="pharmacy"](around:{r},{lat},{lng});
-            node["amenity"="doctors"](around:{r},{lat},{lng});
-            node["amenity"="health_centre"](around:{r},{lat},{lng});
+# ─── NEARBY PLACES API ────────────────────────────────────────────
+# Overpass sub-queries per filter, with {r}/{lat}/{lng} filled in per request.
+# None of them contain literal braces, so str.format is safe here.
+# "all" is split in two halves that run in parallel — Overpass only serves a couple
+# of concurrent requests per client, so more pieces would just queue or get rate-limited
+_QUERY_TEMPLATES = {
+    "elevator": ("""
+        node["highway"="elevator"](around:{r},{lat},{lng});
+        node["amenity"="elevator"](around:{r},{lat},{lng});
+        node["building"="elevator"](around:{r},{lat},{lng});
+        node["amenity"="hospital"](around:{r},{lat},{lng});
+        way["amenity"="hospital"](around:{r},{lat},{lng});
+        node["amenity"="clinic"](around:{r},{lat},{lng});
+        node["amenity"="mall"](around:{r},{lat},{lng});
+        way["shop"="mall"](around:{r},{lat},{lng});
+    """,),
+    "rest": ("""
+        node["amenity"="bench"](around:{r},{lat},{lng});
+        node["leisure"="park"](around:{r},{lat},{lng});
+        way["leisure"="park"](around:{r},{lat},{lng});
+        node["amenity"="shelter"](around:{r},{lat},{lng});
+        node["tourism"="picnic_site"](around:{r},{lat},{lng});
+        node["amenity"="cafe"](around:{r},{lat},{lng});
+        node["amenity"="restaurant"](around:{r},{lat},{lng});
+    """,),
+    "washroom": ("""
+        node["amenity"="toilets"](around:{r},{lat},{lng});
+        way["amenity"="toilets"](around:{r},{lat},{lng});
+        node["amenity"="hospital"](around:{r},{lat},{lng});
+        way["amenity"="hospital"](around:{r},{lat},{lng});
+        node["amenity"="clinic"](around:{r},{lat},{lng});
+        node["amenity"="pharmacy"](around:{r},{lat},{lng});
+        node["shop"="mall"](around:{r},{lat},{lng});
+        way["shop"="mall"](around:{r},{lat},{lng});
+        node["amenity"="cafe"](around:{r},{lat},{lng});
+        node["amenity"="restaurant"](around:{r},{lat},{lng});
+    """,),
+    "hospital": ("""
+        node["amenity"="hospital"](around:{r},{lat},{lng});
+        way["amenity"="hospital"](around:{r},{lat},{lng});
+        node["amenity"="clinic"](around:{r},{lat},{lng});
+        node["amenity"="pharmacy"](around:{r},{lat},{lng});
+        node["amenity"="doctors"](around:{r},{lat},{lng});
+        node["amenity"="health_centre"](around:{r},{lat},{lng});
+    """,),
+    "all": (
+        """
+        node["amenity"~"hospital|clinic|pharmacy|toilets|bench|shelter|cafe|restaurant|doctors"](around:{r},{lat},{lng});
+        way["amenity"~"hospital|clinic"](around:{r},{lat},{lng});
         """,
-        "all": f"""
-            node["amenity"~"hospital|clinic|pharmacy|toilets|bench|shelter|cafe|restaurant|doctors"](around:{r},{lat},{lng});
-            way["amenity"~"hospital|clinic"](around:{r},{lat},{lng});
-            node["leisure"="park"](around:{r},{lat},{lng});
-            way["leisure"="park"](around:{r},{lat},{lng});
-            node["highway"="elevator"](around:{r},{lat},{lng});
+        """
+        node["leisure"="park"](around:{r},{lat},{lng});
+        way["leisure"="park"](around:{r},{lat},{lng});
+        node["highway"="elevator"](around:{r},{lat},{lng});
         """,
-    }
-
-    inner = queries_map.get(filter, queries_map["all"])
-    query = f"[out:json][timeout:20];\n(\n{inner}\n);\nout center 30;"
-
-    def haversine(elat, elng):
-        R = 6371000
-        dlat = math.radians(elat - lat)
-        dlon = math.radians(elng - lng)
-        a = math.sin(dlat/2)**2 + math.cos(math.radians(lat)) * math.cos(math.radians(elat)) * math.sin(dlon/2)**2
-        return int(R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a)))
-
-    def friendly_name(tags):
-        name = tags.get("name")
-        if name:
-            return name.title()
-        label_map = {
-            "bench":         "Seating / Rest Spot",
-            "toilets":       "Public Washroom",
-            "shelter":       "Shelter / Rest Area",
-            "hospital":      "Hospital (Has Washrooms)",
-            "clinic":        "Clinic (Has Washrooms)",
-            "pharmacy":      "Pharmacy",
-            "doctors":       "Doctor",
-            "health_centre": "Health Centre",
-            "park":          "Park",
-            "elevator":      "Elevator",
-            "cafe":          "Café (Has Washrooms)",
-            "restaurant":    "Restaurant (Has Washrooms)",
-            "mall":          "Shopping Mall (Has Washrooms)",
-        }
-        for key in [tags.get("amenity",""), tags.get("highway",""), tags.get("leisure",""), tags.get("shop","")]:
-            if key in label_map:
-                return label_map[key]
-        return "Accessible Place"
+    ),
+}
+
+# "out center 30" keeps the first 30 matches in id order (nodes before ways), not the
+# nearest 30 — any cap drops some nearby places, so keep it loose
+_OVERPASS_QUERIES = {
+    k: tuple(f"[out:json][timeout:20];\n(\n{v}\n);\nout center 30;" for v in parts)
+    for k, parts in _QUERY_TEMPLATES.items()
+}
+
+_LABEL_MAP = {
+    "bench":         "Seating / Rest Spot",
+    "toilets":       "Public Washroom",
+    "shelter":       "Shelter / Rest Area",
+    "hospital":      "Hospital (Has Washrooms)",
+    "clinic":        "Clinic (Has Washrooms)",
+    "pharmacy":      "Pharmacy",
+    "doctors":       "Doctor",
+    "health_centre": "Health Centre",
+    "park":          "Park",
+    "elevator":      "Elevator",
+    "cafe":          "Café (Has Washrooms)",
+    "restaurant":    "Restaurant (Has Washrooms)",
+    "mall":          "Shopping Mall (Has Washrooms)",
+}
+
+# Tag keys checked (in priority order) when labelling and typing a place
+_AMENITY_KEYS = ("amenity", "highway", "leisure", "shop")
+
+# Flat (tag key, tag value) -> label table, so labelling is one lookup per key
+_TAG_LOOKUP = {
+    (key, value): label
+    for key in _AMENITY_KEYS
+    for value, label in _LABEL_MAP.items()
+}
+
+
+def friendly_name(tags):
+    name = tags.get("name")
+    if name:
+        return name.title()
+    for key in _AMENITY_KEYS:
+        label = _TAG_LOOKUP.get((key, tags.get(key)))
+        if label:
+            return label
+    return "Accessible Place"
+
+
+def haversine(lat, lng, elats, elngs):
+    # Distances in metres from (lat, lng) to every element, in one vectorised pass.
+    # .tolist() hands back plain ints so the JSON response can serialise them
+    R = 6371000
+    elats = np.asarray(elats, dtype=np.float64)
+    elngs = np.asarray(elngs, dtype=np.float64)
+    cos_lat = math.cos(math.radians(lat))
+    dlat = np.radians(elats - lat)
+    dlon = np.radians(elngs - lng)
+    a = np.sin(dlat/2)**2 + cos_lat * np.cos(np.radians(elats)) * np.sin(dlon/2)**2
+    return (R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))).astype(np.int32).tolist()
+
+
+@app.get("/api/nearby")
+async def nearby(lat: float, lng: float, filter: str = "all"):
+    r = 2000  # 2km radius
+
+    # Nearby users share one Overpass query (and cache entry) per ~100m grid cell
+    qlat, qlng = round(lat, 3), round(lng, 3)
+
+    if filter not in _OVERPASS_QUERIES:
+        filter = "all"
+    queries = [q.format(r=r, lat=qlat, lng=qlng) for q in _OVERPASS_QUERIES[filter]]
 
     try:
-        resp = httpx.post(
-            "https://overpass-api.de/api/interpreter",
-            data={"data": query},
-            timeout=20
-        )
-        resp.raise_for_status()
-        elements = resp.json().get("elements", [])
+        elements = await fetch_overpass_elements((qlat, qlng, filter), queries)
 
         places = []
+        elats, elngs = [], []
         seen = set()
 
         for el in elements:
-            tags = el.get("tags", {})
-
             if el["type"] == "node":
                 elat, elng = el["lat"], el["lon"]
             else:
@@ -272,42 +437,30 @@ def nearby(lat: float, lng: float, filter: str = "all"):
                     continue
                 elat, elng = center.get("lat", lat), center.get("lon", lng)
 
-            coord_key = (round(elat, 4), round(elng, 4))
+            # Skip duplicates (~10m grid) before any tag or distance work
+            coord_key = (int(elat * 10000), int(elng * 10000))
             if coord_key in seen:
                 continue
             seen.add(coord_key)
 
-            dist = haversine(elat, elng)
+            tags = el.get("tags", {})
+            elats.append(elat)
+            elngs.append(elng)
 
             places.append({
                 "name": friendly_name(tags),
                 "address": tags.get("addr:street") or tags.get("addr:full") or tags.get("addr:place") or "",
                 "lat": elat,
                 "lng": elng,
-                "distance_m": dist,
-                "types": [t for t in [
-                    tags.get("amenity",""),
-                    tags.get("highway",""),
-                    tags.get("leisure",""),
-                    tags.get("shop",""),
-                ] if t],
+                "types": [tags[key] for key in _AMENITY_KEYS if tags.get(key)],
                 "wheelchair": tags.get("wheelchair", ""),
             })
 
-        places.sort(key=lambda p: p["distance_m"])
-        return {"places": places[:15]}
+        for place, dist in zip(places, haversine(lat, lng, elats, elngs)):
+            place["distance_m"] = dist
+
+        # Only the 15 closest are returned, so there's no need to sort the rest
+        return {"places": heapq.nsmallest(15, places, key=itemgetter("distance_m"))}
 
     except Exception as e:
         return {"places": [], "error": str(e)}
-
-
-
-@app.get("/senior/{user_id}")
-def senior(request: Request, user_id: int, db: Session = Depends(get_db)):
-    user = get_user_by_id(db, user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return templates.TemplateResponse("senior.html", {
-        "request": request,
-        "user": user
-    })
\ No newline at end of file